@@ -1,3 +1,4 @@
 from admap.core.ldap import LDAPConnection
 from admap.core.objects import ADRef
 from admap.core.active_directory import ActiveDirectory
+from admap.core.forest import Forest
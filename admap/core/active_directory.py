@@ -1,6 +1,8 @@
 from plutils.log import Logger
 from admap.core import LDAPConnection, ADRef
-from admap.core.nt_security import NTSecurityDescriptor
+from admap.core.nt_security import NTSecurityDescriptor, InheritanceModel
+from admap.core.export import export_parquet
+from admap.core.query import ACEIndex
 from ms_active_directory import ADDomain
 from ldap3 import NTLM, Server
 from pyvis.network import Network
@@ -23,21 +25,21 @@ class ActiveDirectory:
         )
         self.session = self.domain.create_session_as_user(ntlm_username, password, authentication_mechanism=NTLM)
 
-        # all sids
-        self.sids: set[str] = {entry.objectSid.value for entry in self.conn.search(attributes=["objectSid"]) if hasattr(entry, "objectSid") and entry.objectSid}
-
         # References to all objects in the active directory
         self.refs: set[ADRef] = set()
 
         self.map: dict[str, ADRef] = {}
         self._guid_map: dict[str, ADRef] = {}
 
+        # index over all ACEs, built on the first query
+        self._ace_index: ACEIndex | None = None
+
     def test(self):
         import logging
         import plutils.log as pl_log
         log.info("Test function")
         log.debug(f"Connected to {self.domain}")
-        self.__gather()
+        self.gather()
         log.debug("Generating and saving graph")
         self.save_pyvis("/tmp/graph.html")
 
@@ -56,6 +58,46 @@ class ActiveDirectory:
         net.repulsion(node_distance=1000, spring_length=2000, central_gravity=0.1)
         net.show(path, notebook=False)
 
+    def export_parquet(self, directory: str, chunk_size: int = 65536, compression: str = "zstd") -> tuple[str, str]:
+        """
+        Export all objects and their ACEs as columnar parquet tables (objects.parquet and aces.parquet),
+        e.g. for loading them into pandas or DuckDB
+        Gathers the objects first if they were not gathered yet.
+
+        :param directory: the directory to write the tables to
+        :param chunk_size: how many rows to buffer before writing a row group
+        :param compression: the parquet compression codec
+        :return: paths of the object table and the ace table
+        """
+        if not self.map:
+            self.gather()
+        return export_parquet(self.map.values(), directory, chunk_size, compression)
+
+    def inheritance_model(self) -> InheritanceModel:
+        """
+        Create the inheritance model of all objects, which stores only their explicit ACEs
+        and computes inherited ACEs from the parent containers. The DACLs of the objects are not modified.
+        Gathers the objects first if they were not gathered yet.
+        """
+        if not self.map:
+            self.gather()
+        return InheritanceModel.from_refs(self.map.values(), self.conn.get_class_guids())
+
+    def query(self, query: str):
+        """
+        Search the ACEs of all objects, e.g. `mask has GENERIC_WRITE and class = computer and dn under "OU=X,DC=corp,DC=local"`,
+        see admap.core.query for the syntax. The index over all ACEs is built on the first query.
+        Gathers the objects first if they were not gathered yet.
+
+        :param query: the query
+        :return: generator of matching objects and aces
+        """
+        if not self.map:
+            self.gather()
+        if self._ace_index is None:
+            self._ace_index = ACEIndex(self.map.values())
+        return self._ace_index.query(query)
+
     def graph_networkx(self):
         """
         Create a networkx graph of the active directory
@@ -78,40 +120,18 @@ class ActiveDirectory:
         return graph
 
 
-    def __gather(self):
+    def gather(self):
         """
-        Gather all objects in the active directory
+        Gather all objects in the active directory and their NT security descriptors
         """
         log.debug("Gathering all objects in the active directory")
-        log.debug("Gathering objects (using ldap3)")
-        entries = self.conn.search()
-        self.refs = {ADRef(entry) for entry in entries if entry.objectSid}
-        log.debug(f"Found {len(entries)} objects (with SIDs)")
-        self.map = {ref.sid: ref for ref in self.refs}
-
-        log.debug("Gathering objects (using ms_active_directory)")
-
-        for sid in self.sids:
-            object = self.session.find_object_by_sid(sid)
-            if not object:
-                log.critical(f"Could not find object with sid {sid}")
-                exit()
-            sd = self.session.find_security_descriptor_for_object(object)
-            log.debug(f"Found {object.distinguished_name if not hasattr(object, "name") else object.name} ({object.__class__.__name__})")
-            if sd:
-                object.security_descriptor = sd
-                log.debug(f"Found sd: {sd["Dacl"]["AclRevision"]} ({sd.__class__.__name__})")
-                #log.debug(object.security_descriptor)
-            self.map[sid] = object
-        return
-
-
         entries = self.conn.search()
-        self.refs = {ADRef(entry) for entry in entries}
-        log.debug(f"Found {len(entries)} objects")
+        self.refs = {ADRef(entry) for entry in entries if hasattr(entry, "objectSid") and entry.objectSid}
+        log.debug(f"Found {len(entries)} objects ({len(self.refs)} with SIDs)")
 
-        self.map = {ref.sid: ref for ref in self.refs if ref.sid}
+        self.map = {ref.sid: ref for ref in self.refs}
         self._guid_map = {ref.guid: ref for ref in self.refs if ref.guid}
+        self._ace_index = None
 
         # gather the NT security descriptor of all objects
         self.__gather_nt_security()
@@ -121,8 +141,9 @@ class ActiveDirectory:
         Gather the NT security descriptor of all objects in the active directory
         """
         log.debug("Gathering the NT security descriptor of all objects in the active directory")
+        sds = self.conn.get_ad_security_descriptors(ref.dn for ref in self.refs)
         for ref in self.refs:
-            sd = self.conn.get_ad_security_descriptor(ref.dn)
+            sd = sds.get(ref.dn)
             if sd:
                 ref.security_descriptor = NTSecurityDescriptor.from_bytes(sd)
                 log.debug(f"Found security descriptor for {ref.name} ({ref.sid})")
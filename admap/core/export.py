@@ -0,0 +1,131 @@
+from plutils.log import Logger
+from admap.core.objects import ADRef
+from typing import Iterable
+import pyarrow as pa
+import pyarrow.parquet as pq
+import os
+
+log = Logger(__name__, color="green")
+
+
+OBJECT_SCHEMA = pa.schema([
+    ("sid", pa.string()),
+    ("dn", pa.string()),
+    ("object_class", pa.string()),
+    ("owner_sid", pa.string()),
+])
+
+ACE_SCHEMA = pa.schema([
+    ("object_sid", pa.string()),
+    ("trustee_sid", pa.string()),
+    ("ace_type", pa.uint8()),
+    ("ace_flags", pa.uint8()),
+    ("access_mask", pa.uint32()),
+    ("object_type", pa.string()),
+    ("inherited_object_type", pa.string()),
+    ("inherited", pa.bool_()),
+])
+
+
+"""
+Writes rows of a fixed schema to a parquet file in row groups of `chunk_size` rows,
+so that only a single chunk has to be held in memory at any time
+"""
+class ChunkedParquetWriter:
+    def __init__(self, path: str, schema: pa.Schema, chunk_size: int = 65536, compression: str = "zstd"):
+        """
+        :param path: the path of the parquet file
+        :param schema: the schema of the rows
+        :param chunk_size: how many rows to buffer before writing a row group
+        :param compression: the parquet compression codec
+        """
+        self.path = path
+        self.schema = schema
+        self.chunk_size = chunk_size
+        self.writer = pq.ParquetWriter(path, schema, compression=compression)
+        self.rows = 0
+        self._columns: dict[str, list] = {name: [] for name in schema.names}
+
+    def append(self, *values):
+        """
+        Append a single row, the values have to be in the order of the schema
+        """
+        for column, value in zip(self._columns.values(), values):
+            column.append(value)
+        if len(self._columns[self.schema.names[0]]) >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        """
+        Write the buffered rows as a row group
+        """
+        count = len(self._columns[self.schema.names[0]])
+        if not count:
+            return
+        self.writer.write_table(pa.Table.from_pydict(self._columns, schema=self.schema))
+        self.rows += count
+        log.debug(f"Wrote {count} rows to {self.path} ({self.rows} total)")
+        for column in self._columns.values():
+            column.clear()
+
+    def close(self):
+        self.flush()
+        self.writer.close()
+
+    def __enter__(self) -> "ChunkedParquetWriter":
+        return self
+
+    def abort(self):
+        """
+        Close the file without writing the buffered rows and remove it,
+        so that an incomplete export cannot be mistaken for a complete one
+        """
+        self.writer.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        log.error(f"Export to {self.path} failed, removed incomplete file")
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+def export_parquet(refs: Iterable[ADRef], directory: str, chunk_size: int = 65536, compression: str = "zstd") -> tuple[str, str]:
+    """
+    Export objects and their ACEs as two parquet tables (objects.parquet and aces.parquet).
+    Both tables are written in row groups of `chunk_size` rows, ACEs reference their object by `object_sid`.
+
+    :param refs: the objects to export
+    :param directory: the directory to write the tables to
+    :param chunk_size: how many rows to buffer before writing a row group
+    :param compression: the parquet compression codec
+    :return: paths of the object table and the ace table
+    """
+    os.makedirs(directory, exist_ok=True)
+    objects_path = os.path.join(directory, "objects.parquet")
+    aces_path = os.path.join(directory, "aces.parquet")
+    log.info(f"Exporting objects to {objects_path} and ACEs to {aces_path}")
+
+    with ChunkedParquetWriter(objects_path, OBJECT_SCHEMA, chunk_size, compression) as objects, \
+            ChunkedParquetWriter(aces_path, ACE_SCHEMA, chunk_size, compression) as aces:
+        for ref in refs:
+            sd = ref.security_descriptor
+            objects.append(ref.sid, ref.dn, ref.object_class_name, sd.owner_sid if sd else None)
+            if not sd or not sd.dacl:
+                continue
+            for ace in sd.dacl:
+                aces.append(
+                    ref.sid,
+                    ace.trustee_sid,
+                    ace.header.type,
+                    ace.header.flags,
+                    ace.header.mask,
+                    ace.object_type,
+                    ace.inherited_object_type,
+                    ace.inherited,
+                )
+
+    log.info(f"Exported {objects.rows} objects and {aces.rows} ACEs")
+    return objects_path, aces_path
@@ -0,0 +1,188 @@
+from plutils.log import Logger
+from admap.core.ldap import LDAPConnection
+from admap.core.objects import ADRef
+from admap.core.nt_security import NTSecurityDescriptor
+from concurrent.futures import ThreadPoolExecutor
+from pyvis.network import Network
+import networkx as nx
+import threading
+
+log = Logger(__name__, color="green")
+
+# crossRef objects with FLAG_CR_NTDS_DOMAIN set describe the domains of the forest, see
+# https://learn.microsoft.com/en-us/openspecs/windows_protocols/ms-adts/1e38247d-8234-4273-9de3-bbf313548631
+DOMAIN_CROSS_REF_FILTER = "(&(objectClass=crossRef)(systemFlags:1.2.840.113556.1.4.803:=2))"
+
+# SIDs of the BUILTIN domain, the same SIDs refer to different objects in every domain of the forest
+DOMAIN_LOCAL_SID_PREFIX = "S-1-5-32-"
+
+
+def node_id(domain: str, sid: str) -> str:
+    """
+    Identifies an object within the forest. Domain-local SIDs (BUILTIN, S-1-5-32-*)
+    are qualified with the dns name of their domain, e.g. S-1-5-32-544@corp.local
+
+    :param domain: the dns name of the domain the sid is used in
+    :param sid: the sid of the object
+    """
+    if sid.startswith(DOMAIN_LOCAL_SID_PREFIX):
+        return f"{sid}@{domain}"
+    return sid
+
+
+"""
+All domains of an active directory forest, each domain is crawled concurrently
+using its own connections, foreign SIDs are resolved through the Global Catalog
+"""
+class Forest:
+    def __init__(self, server, ntlm_username, password, ldap_port=389, gc_port=None, use_ssl=False):
+        """
+        :param server: a domain controller of the forest, also used as Global Catalog
+        :param ntlm_username: username in the form DOMAIN\\user
+        :param password: password of the user
+        :param ldap_port: port of the LDAP service of the domain controllers
+        :param gc_port: port of the Global Catalog service, defaults to 3268, or 3269 when using SSL
+        :param use_ssl: whether to use SSL
+        """
+        self.username = ntlm_username
+        self.password = password
+        self.ldap_port = ldap_port
+        self.use_ssl = use_ssl
+        gc_port = gc_port or (3269 if use_ssl else 3268)
+
+        self.conn = LDAPConnection(server, ldap_port, ntlm_username, password, use_ssl)
+        # the Global Catalog covers the whole forest, thus the search base is empty
+        self.gc = LDAPConnection(server, gc_port, ntlm_username, password, use_ssl, base="")
+
+        # dns name of each domain by naming context
+        self.domains: dict[str, str] = {}
+        # objects of each domain by naming context
+        self.maps: dict[str, dict[str, ADRef]] = {}
+
+        # cache for SIDs looked up in the Global Catalog, None if the SID could not be resolved
+        self._gc_cache: dict[str, ADRef | None] = {}
+        self._gc_lock = threading.Lock()
+
+    def enumerate_domains(self) -> dict[str, str]:
+        """
+        Enumerate the domains of the forest using the crossRef objects in the configuration partition
+
+        :return: the dns name of each domain by naming context
+        """
+        configuration = self.conn.root_dse.configurationNamingContext.value
+        entries = self.conn.search(
+            base=f"CN=Partitions,{configuration}",
+            filter=DOMAIN_CROSS_REF_FILTER,
+            attributes=["nCName", "dnsRoot"],
+        )
+        self.domains = {entry.nCName.value: entry.dnsRoot.value for entry in entries}
+        log.info(f"Found {len(self.domains)} domains: {', '.join(self.domains.values())}")
+        return self.domains
+
+    def gather(self, max_workers: int | None = None):
+        """
+        Gather all objects of all domains in the forest, one worker per domain
+
+        :param max_workers: maximum number of domains crawled at the same time, defaults to all domains
+        """
+        if not self.domains:
+            self.enumerate_domains()
+        if not self.domains:
+            log.error("No domains found in the forest")
+            return
+        with ThreadPoolExecutor(max_workers=max_workers or len(self.domains)) as executor:
+            results = executor.map(self.__gather_domain, self.domains.keys(), self.domains.values())
+            self.maps = dict(zip(self.domains.keys(), results))
+
+    def __gather_domain(self, naming_context: str, dns_root: str) -> dict[str, ADRef]:
+        """
+        Gather all objects of a single domain and their NT security descriptors
+
+        :param naming_context: the naming context of the domain
+        :param dns_root: the dns name of the domain
+        :return: the objects of the domain by sid
+        """
+        log.debug(f"Gathering objects of {dns_root} ({naming_context})")
+        conn = LDAPConnection(dns_root, self.ldap_port, self.username, self.password, self.use_ssl, base=naming_context)
+        refs = {ADRef(entry) for entry in conn.search() if hasattr(entry, "objectSid") and entry.objectSid}
+
+        sds = conn.get_ad_security_descriptors(ref.dn for ref in refs)
+        for ref in refs:
+            sd = sds.get(ref.dn)
+            if sd:
+                ref.security_descriptor = NTSecurityDescriptor.from_bytes(sd)
+        log.info(f"Found {len(refs)} objects in {dns_root}")
+        return {ref.sid: ref for ref in refs}
+
+    @property
+    def map(self) -> dict[str, ADRef]:
+        """
+        All objects of the forest by node id, i.e. by sid with domain-local SIDs qualified by domain (see node_id)
+        """
+        return {
+            node_id(self.domains[naming_context], sid): ref
+            for naming_context, objects in self.maps.items()
+            for sid, ref in objects.items()
+        }
+
+    def resolve_sid(self, sid: str) -> ADRef | None:
+        """
+        Look up an object by sid in the Global Catalog, results are cached.
+        Domain-local SIDs are not looked up, as they are ambiguous within the forest.
+
+        :param sid: the sid of the object
+        :return: the object or None if it is not in the forest
+        """
+        if sid.startswith(DOMAIN_LOCAL_SID_PREFIX):
+            return None
+        with self._gc_lock:
+            if sid in self._gc_cache:
+                return self._gc_cache[sid]
+        # active directory accepts SIDs in string representation in filters
+        entries = self.gc.search(filter=f"(objectSid={sid})", attributes=["objectSid", "objectGUID", "objectClass", "name"], paged=False)
+        ref = ADRef(entries[0]) if entries else None
+        with self._gc_lock:
+            self._gc_cache[sid] = ref
+        return ref
+
+    def save_pyvis(self, path: str, height: str = "1080px", width: str = "100%"):
+        """
+        Save the forest graph as a pyvis html file
+
+        :param path: the path to save the html file
+        :param height: the height of the graph
+        :param width: the width of the graph
+        """
+        log.info(f"Saving graph to {path}")
+        net = Network(height=height, width=width, directed=True)
+        net.from_nx(self.graph_networkx())
+        net.repulsion(node_distance=1000, spring_length=2000, central_gravity=0.1)
+        net.show(path, notebook=False)
+
+    def graph_networkx(self):
+        """
+        Create a single networkx graph of all domains in the forest,
+        trustees from other domains are resolved through the Global Catalog
+        """
+        log.debug("Creating networkx graph of the forest")
+        graph = nx.DiGraph()
+        for naming_context, objects in self.maps.items():
+            domain = self.domains[naming_context]
+            for sid, ref in objects.items():
+                graph.add_node(node_id(domain, sid), size=20, label=ref.name, title=sid, group=domain)
+        for naming_context, objects in self.maps.items():
+            domain = self.domains[naming_context]
+            for sid, ref in objects.items():
+                if not ref.security_descriptor or not ref.security_descriptor.dacl:
+                    continue
+                for ace in ref.security_descriptor.dacl:
+                    # domain-local trustees refer to the objects of the domain of the ace
+                    trustee_id = node_id(domain, ace.trustee_sid)
+                    if trustee_id not in graph:
+                        trustee = self.resolve_sid(ace.trustee_sid)
+                        if not trustee:
+                            log.error(f"Could not find ACE trustee {trustee_id}")
+                            continue
+                        graph.add_node(trustee_id, size=20, label=trustee.name, title=trustee.sid, group="foreign")
+                    graph.add_edge(node_id(domain, sid), trustee_id, label=str(ace.permissions))
+        return graph
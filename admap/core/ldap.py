@@ -1,12 +1,21 @@
 from plutils.log import Logger
-from ldap3 import Server, Connection, ALL, NTLM, SUBTREE
+from admap.core.scheduler import RequestScheduler, LDAP_OVERLOAD_RESULTS
+from ldap3 import Server, Connection, ALL, NTLM, SUBTREE, BASE
+from ldap3.core.exceptions import LDAPCommunicationError, LDAPBindError, LDAPOperationResult, LDAPNoSuchObjectResult
 from ldap3.protocol.microsoft import security_descriptor_control
 from ldap3.abstract.entry import Entry
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Iterable
+import threading
+import time
 
 log = Logger(__name__, "green")
 
+# OID of the simple paged results control, see https://www.rfc-editor.org/rfc/rfc2696
+PAGED_RESULTS_OID = "1.2.840.113556.1.4.319"
+
 class LDAPConnection:
-    def __init__(self, server, port, username, password, use_ssl=False):
+    def __init__(self, server, port, username, password, use_ssl=False, max_in_flight: int = 16, page_size: int = 1000, base: str | None = None):
         self.server = server
         self.port = port
         self.username = username
@@ -15,62 +24,231 @@ class LDAPConnection:
 
         log.debug(f"Connecting to {server}:{port} as {username}:{password}..")
         self.server = Server(self.server, port=self.port, get_info=ALL, use_ssl=self.use_ssl)
-        self.conn = Connection(self.server, user=self.username, password=self.password, authentication=NTLM, auto_bind=True)
+        self.conn = self._connect()
         log.debug("Connection established")
 
-        self._ad_root = None
-
-    @staticmethod
-    def ensure_connection(func):
-        # decorator to ensure the connection is bound before calling the function
-        def wrapper(self, *args, **kwargs):
-            if not self.conn.bound:
-                self.conn.bind()
-            return func(self, *args, **kwargs)
-        return wrapper
-
-    @ensure_connection
-    def search(self, base: str | None = None, filter: str | None = None, scope: str | None = None, attributes: list[str] | None = None, controls = None) -> list[Entry]:
-        """
-        Search the LDAP server for entries
-        """
-        search_base = base or self.ad_root
-        search_filter = filter or "(objectClass=*)"
-        search_scope = scope or SUBTREE
-        attributes = attributes or ['*', 'objectSid', 'objectGUID']
-        self.conn.search(
-            search_base=search_base,
-            search_filter=search_filter,
-            search_scope=search_scope,
-            attributes=attributes,
-            controls=controls
-            )
-        return self.conn.entries
+        # requests to the same server share a scheduler, which limits the in-flight requests and page size
+        self.scheduler = RequestScheduler.for_server(f"{server}:{port}", max_in_flight=max_in_flight, page_size=page_size)
+        # idle connections, each in-flight request uses its own connection
+        self._pool: list[Connection] = [self.conn]
+        self._pool_lock = threading.Lock()
+
+        # default search base, e.g. the naming context of a specific domain in the forest
+        self._ad_root = base
+
+    def _connect(self) -> Connection:
+        return Connection(self.server, user=self.username, password=self.password, authentication=NTLM, auto_bind=True)
+
+    def _request(self, operation: Callable[[Connection], bool], kind: str = "search", cost: int = 1, conn: Connection | None = None) -> Connection:
+        """
+        Run an operation through the scheduler of the server. The operation is retried with
+        exponential backoff if the server is overloaded or the connection was lost, in which case
+        the connection is rebound transparently.
+        Raises an LDAPOperationResult if the server responds with any other error and an LDAPBindError
+        if binding fails, which is not retried to avoid locking out the account on invalid credentials.
+
+        :param operation: the operation to run on a bound connection, returns whether it succeeded
+        :param kind: the kind of request, used to compare latencies between similar requests
+        :param cost: the number of entries requested, the latency is recorded per entry
+        :param conn: run the operation on this connection instead of one from the pool, e.g. the following pages
+            of a paged search. If it is lost, the error is raised instead of retrying on another connection.
+        :return: the connection the operation succeeded on, holding the result of the operation
+        """
+        pinned = conn is not None
+        retries = self.scheduler.max_retries
+        for attempt in range(retries + 1):
+            with self.scheduler:
+                start = time.monotonic()
+                try:
+                    if conn is None:
+                        conn = self._checkout()
+                    if not conn.bound and not conn.bind():
+                        raise LDAPBindError(f"Could not rebind to {self.scheduler.server}: {conn.result}")
+                    operation(conn)
+                except LDAPBindError:
+                    # e.g. invalid or expired credentials, retrying could lock out the account
+                    if conn is not None:
+                        self._discard(conn)
+                    raise
+                except LDAPCommunicationError as e:
+                    # connection was lost, throw it away and retry on a fresh one
+                    if conn is not None:
+                        self._discard(conn)
+                        conn = None
+                    self.scheduler.record_overload(f"{e.__class__.__name__}: {e}")
+                    if pinned:
+                        raise
+                else:
+                    result = conn.result or {}
+                    code = result.get("result", 0)
+                    if code == 0:
+                        self.scheduler.record_success((time.monotonic() - start) / max(1, cost), kind)
+                        # the caller reads the result from the connection before returning it to the pool
+                        return conn
+                    if code not in LDAP_OVERLOAD_RESULTS:
+                        if not pinned:
+                            self._checkin(conn)
+                        raise LDAPOperationResult(result=code, description=result.get("description"), dn=result.get("dn"),
+                                                  message=result.get("message"), response_type=result.get("type"))
+                    self.scheduler.record_overload(LDAP_OVERLOAD_RESULTS[code])
+                    if not pinned:
+                        self._checkin(conn)
+                        conn = None
+            if attempt == retries:
+                break
+            delay = self.scheduler.delay(attempt)
+            log.debug(f"Retrying request in {delay:.2f}s (retry {attempt + 1}/{retries})")
+            time.sleep(delay)
+        raise ConnectionError(f"Request to {self.scheduler.server} failed after {retries} retries")
+
+    def _checkout(self) -> Connection:
+        with self._pool_lock:
+            if self._pool:
+                return self._pool.pop()
+        return self._connect()
+
+    def _checkin(self, conn: Connection):
+        with self._pool_lock:
+            self._pool.append(conn)
+
+    def _discard(self, conn: Connection):
+        try:
+            conn.unbind()
+        except LDAPCommunicationError:
+            pass
+
+    def search(self, base: str | None = None, filter: str | None = None, scope: str | None = None, attributes: list[str] | None = None, controls = None, paged: bool = True) -> list[Entry]:
+        """
+        Search the LDAP server for entries. Results are requested in pages whose size is chosen by the scheduler.
+        Raises an LDAPOperationResult if the server responds with an error.
+
+        :param paged: whether to use the simple paged results control
+        """
+        search = {
+            "search_base": base if base is not None else self.ad_root,
+            "search_filter": filter or "(objectClass=*)",
+            "search_scope": scope or SUBTREE,
+            "attributes": attributes or ['*', 'objectSid', 'objectGUID'],
+            "controls": controls,
+        }
+
+        if not paged:
+            conn = self._request(lambda conn: conn.search(**search))
+            entries = list(conn.entries)
+            self._checkin(conn)
+            return entries
+
+        retries = self.scheduler.max_retries
+        for attempt in range(retries + 1):
+            try:
+                return self.__paged_search(search)
+            except LDAPCommunicationError as e:
+                if attempt == retries:
+                    raise ConnectionError(f"Paged search of {search['search_base']} failed after {retries} restarts") from e
+                delay = self.scheduler.delay(attempt)
+                log.warning(f"Lost connection during paged search of {search['search_base']}, restarting in {delay:.2f}s (retry {attempt + 1}/{retries})")
+                time.sleep(delay)
+
+    def __paged_search(self, search: dict) -> list[Entry]:
+        """
+        Request all pages of a search on a single connection, as the paged results cookie
+        is only valid on the connection that issued it. If the connection is lost, the
+        error is raised and the search has to be restarted from the first page.
+
+        :param search: arguments of ldap3.Connection.search
+        """
+        entries = []
+        cookie = None
+        conn = None
+        try:
+            while True:
+                page_size = self.scheduler.page_size
+                conn = self._request(
+                    lambda conn: conn.search(**search, paged_size=page_size, paged_cookie=cookie),
+                    kind="page", cost=page_size, conn=conn,
+                )
+                entries.extend(conn.entries)
+                cookie = (conn.result.get("controls") or {}).get(PAGED_RESULTS_OID, {}).get("value", {}).get("cookie")
+                if not cookie:
+                    return entries
+        except (LDAPCommunicationError, LDAPBindError):
+            # the connection was already discarded
+            conn = None
+            raise
+        finally:
+            if conn is not None:
+                self._checkin(conn)
 
-    @ensure_connection
     def get_ad_security_descriptor(self, dn: str):
         """
         Get the security descriptor of an active directory object, given its distinguished name.
-        Keep in mind that this method only tries to get the DACL of the object.
+        Keep in mind that this method only tries to get the owner, the group and the DACL of the object.
 
         :param dn: the distinguished name of the object
         """
-        entries = self.search(
-            base=dn,
-            attributes=['ntSecurityDescriptor'],
-            controls = security_descriptor_control(sdflags=0x04)
-        )
+        try:
+            entries = self.search(
+                base=dn,
+                scope=BASE,
+                attributes=['ntSecurityDescriptor'],
+                controls = security_descriptor_control(sdflags=0x07),
+                paged=False,
+            )
+        except LDAPNoSuchObjectResult:
+            # object was deleted since it was found
+            log.warning(f"Object {dn} does not exist")
+            return None
         if entries:
             entry = entries[0]
             return entry['ntSecurityDescriptor'].value
         return None
 
+    def get_ad_security_descriptors(self, dns: Iterable[str]) -> dict[str, bytes | None]:
+        """
+        Get the security descriptors of multiple active directory objects concurrently,
+        the number of concurrent requests is limited by the scheduler of the server.
+
+        :param dns: the distinguished names of the objects
+        :return: the security descriptors by distinguished name
+        """
+        dns = list(dns)
+        with ThreadPoolExecutor(max_workers=self.scheduler.max_in_flight) as executor:
+            return dict(zip(dns, executor.map(self.get_ad_security_descriptor, dns)))
+
+    def get_class_guids(self) -> dict[str, str]:
+        """
+        Get the schemaIDGUID of all object classes in the schema, e.g. to match inherited object types of ACEs
+
+        :return: the guid of each object class by lDAPDisplayName
+        """
+        entries = self.search(
+            base=self.root_dse.schemaNamingContext.value,
+            filter="(objectClass=classSchema)",
+            attributes=['lDAPDisplayName', 'schemaIDGUID'],
+        )
+        return {entry.lDAPDisplayName.value: entry.schemaIDGUID.value for entry in entries}
+
+    @property
+    def root_dse(self) -> Entry:
+        """
+        Get the root DSE of the server, see https://learn.microsoft.com/en-us/openspecs/windows_protocols/ms-adts/96f7b086-1ca0-4764-9a08-33f30315a555
+        """
+        return self.search(
+            base='',
+            scope=BASE,
+            attributes=['defaultNamingContext', 'rootDomainNamingContext', 'configurationNamingContext', 'schemaNamingContext', 'namingContexts'],
+            paged=False,
+        )[0]
+
     @property
     def ad_root(self) -> str:
         """
-        Get the root entry of the active directory
+        Get the root entry of the active directory, i.e. the naming context of the domain of the server
         """
-        if not self._ad_root:
-            self.conn.search(search_base='', search_scope='BASE', attributes=['namingContexts'], search_filter='(objectClass=*)')
-            self._ad_root = self.conn.entries[0].namingContexts[0]
+        if self._ad_root is None:
+            root_dse = self.root_dse
+            if root_dse.defaultNamingContext:
+                self._ad_root = root_dse.defaultNamingContext.value
+            else:
+                self._ad_root = root_dse.namingContexts[0]
         return self._ad_root
@@ -1,2 +1,3 @@
 import admap.core.nt_security.types as types
 from admap.core.nt_security.security_descriptor import NTSecurityDescriptor
+from admap.core.nt_security.inheritance import InheritanceModel
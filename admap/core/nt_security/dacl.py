@@ -80,6 +80,8 @@ class ACE:
                 log.warning(f"Unsupported ACE type {hex(ace_type)}")
                 ace_type = None
 
+        # only keep the data of this ace, not the remainder of the acl
+        data = data[:ace_size]
         header = ProtocolHeader(data, 2, type=ace_type, flags=ace_flags, size=ace_size, mask=access_mask)
         return cls(data, trustee_sid, object_type, object_type_flags, inherited_object_type, application_data, header)
 
@@ -104,6 +106,39 @@ class ACE:
                 aces.add(ace)
         return aces
 
+    def copy(self, flags: int | None = None, mask: int | None = None, trustee_sid: str | None = None) -> "ACE":
+        """
+        Returns a copy of the ACE with different flags, access mask or trustee, e.g. to derive an inherited ACE
+
+        :param flags: the new ace flags
+        :param mask: the new access mask
+        :param trustee_sid: the new trustee
+        :return: the copy of the ace
+        """
+        flags = self.header.flags if flags is None else flags
+        mask = self.header.mask if mask is None else mask
+        trustee_sid = trustee_sid or self.trustee_sid
+
+        data = self.data
+        if trustee_sid != self.trustee_sid:
+            # the trustee follows the header, the object type flags and the object type guids (if present)
+            sid_offset = 8
+            if self.object_type_flags is not None:
+                sid_offset = 12 + 16 * ((self.object_type is not None) + (self.inherited_object_type is not None))
+            sid_size = 8 + 4 * data[sid_offset + 1]
+            data = data[:sid_offset] + ProtocolHeader.pack_sid(trustee_sid) + data[sid_offset + sid_size:]
+        data = struct.pack("<BBHI", self.header.type, flags, len(data), mask) + data[8:]
+
+        header = ProtocolHeader(data, 2, type=self.header.type, flags=flags, size=len(data), mask=mask)
+        return ACE(data, trustee_sid, self.object_type, self.object_type_flags, self.inherited_object_type, self.application_data, header)
+
+    @property
+    def key(self) -> tuple:
+        """
+        Identifies the ACE by its content, two ACEs with the same key grant the same access
+        """
+        return (self.header.type, self.header.flags, self.header.mask, self.trustee_sid, self.object_type, self.inherited_object_type)
+
     @property
     def permissions(self) -> set[str]:
         """
@@ -78,6 +78,20 @@ class ProtocolHeader:
             exit(-1)
         return sid_str
 
+    @staticmethod
+    def pack_sid(sid: str) -> bytes:
+        """
+        Packs a SID in string representation into its binary representation, the inverse of parse_sid
+
+        :param sid: the sid in string representation, e.g. S-1-5-32-544
+        :return: the sid in binary representation
+        """
+        _, revision, identifier_authority, *sub_authorities = sid.split("-")
+        sub_authorities = [int(sub_authority) for sub_authority in sub_authorities]
+        return (struct.pack("<BB", int(revision), len(sub_authorities))
+            + int(identifier_authority, 0).to_bytes(6, "big")
+            + struct.pack("<" + "I" * len(sub_authorities), *sub_authorities))
+
     @staticmethod
     def parse_guid(data: bytes, offset: int = 0) -> str:
         """
@@ -0,0 +1,226 @@
+from plutils.log import Logger
+from admap.core.nt_security.dacl import ACE
+from admap.core.nt_security.security_descriptor import NTSecurityDescriptor
+from admap.core.nt_security.types import DS_GENERIC_MAPPING, OBJECT_INHERIT_ACE, CONTAINER_INHERIT_ACE, NO_PROPAGATE_INHERIT_ACE, INHERIT_ONLY_ACE, INHERITED_ACE
+from typing import Iterable, Iterator
+import re
+
+log = Logger(__name__, "#ffaaaa")
+
+# ace flags removed or set when an ace is inherited
+INHERITANCE_FLAGS = OBJECT_INHERIT_ACE | CONTAINER_INHERIT_ACE | NO_PROPAGATE_INHERIT_ACE | INHERIT_ONLY_ACE
+
+# SE_DACL_PROTECTED, the dacl does not inherit aces from the parent
+SD_DACL_PROTECTED = 0x1000
+
+# trustees replaced by the owner and group of the object inheriting the ace
+CREATOR_OWNER = "S-1-3-0"
+CREATOR_GROUP = "S-1-3-1"
+
+# separates the rdn from the parent dn, ignoring escaped commas
+_DN_SEPARATOR = re.compile(r"(?<!\\),")
+
+
+def parent_dn(dn: str) -> str | None:
+    """
+    The distinguished name of the parent of an object
+
+    :param dn: the distinguished name of the object
+    :return: the distinguished name of the parent or None if the object has no parent
+    """
+    parts = _DN_SEPARATOR.split(dn, maxsplit=1)
+    return parts[1] if len(parts) > 1 else None
+
+
+def map_generic(mask: int) -> int:
+    """
+    Maps the generic rights of an access mask to the rights of directory objects
+
+    :param mask: the access mask
+    :return: the access mask without generic rights
+    """
+    for generic, mapped in DS_GENERIC_MAPPING.items():
+        if mask & generic:
+            mask = (mask & ~generic) | mapped
+    return mask
+
+
+def inherit_ace(ace: ACE, child_guid: str | None, is_container: bool = True) -> list[ACE]:
+    """
+    Derives the ACEs a child object inherits from an ACE of its parent, as described in
+    https://learn.microsoft.com/en-us/openspecs/windows_protocols/ms-dtyp/0dd4a5ef-8e8e-4b5f-a44a-4bcbb4bd2a1a (ComputeInheritedACLfromParent)
+    including the post processing of the inherited ACL: generic rights are mapped and an ACE that applies to
+    the child and still propagates, but contains generic rights or a creator trustee, is split into an inherit
+    only ACE and an effective ACE. CREATOR OWNER and CREATOR GROUP are left in the effective ACE, as they depend on
+    the child, see InheritanceModel.inherited.
+
+    :param ace: the ace of the parent
+    :param child_guid: the schemaIDGUID of the object class of the child
+    :param is_container: whether the child is a container, all directory objects are
+    :return: the inherited aces, empty if the ace is not inherited by the child
+    """
+    flags = ace.header.flags
+    if not flags & (OBJECT_INHERIT_ACE | CONTAINER_INHERIT_ACE):
+        return []
+
+    if is_container:
+        if flags & CONTAINER_INHERIT_ACE:
+            if flags & NO_PROPAGATE_INHERIT_ACE:
+                # applies to the child but is not propagated further
+                flags &= ~INHERITANCE_FLAGS
+            else:
+                flags &= ~INHERIT_ONLY_ACE
+        elif flags & NO_PROPAGATE_INHERIT_ACE:
+            return []
+        else:
+            # only object inherit, is propagated to the objects within the child
+            flags |= INHERIT_ONLY_ACE
+    else:
+        if not flags & OBJECT_INHERIT_ACE:
+            return []
+        flags &= ~INHERITANCE_FLAGS
+
+    # ace is limited to objects of a different class
+    if ace.inherited_object_type and ace.inherited_object_type.lower() != (child_guid or "").lower():
+        if not flags & (OBJECT_INHERIT_ACE | CONTAINER_INHERIT_ACE):
+            return []
+        flags |= INHERIT_ONLY_ACE
+
+    flags |= INHERITED_ACE
+    # does not apply to the child, passed on unchanged
+    if flags & INHERIT_ONLY_ACE:
+        return [ace.copy(flags=flags)]
+
+    mask = map_generic(ace.header.mask)
+    if mask == ace.header.mask and ace.trustee_sid not in (CREATOR_OWNER, CREATOR_GROUP):
+        return [ace.copy(flags=flags)]
+
+    # effective ace for the child, which is not propagated
+    aces = [ace.copy(flags=flags & ~INHERITANCE_FLAGS, mask=mask)]
+    if flags & (OBJECT_INHERIT_ACE | CONTAINER_INHERIT_ACE):
+        # unmodified ace propagated to the objects within the child
+        aces.append(ace.copy(flags=flags | INHERIT_ONLY_ACE))
+    return aces
+
+
+"""
+Inheritance model of the DACLs of a tree of objects.
+Only the explicit ACEs of each object are stored, inherited ACEs are computed
+from the ACEs of the parent containers and cached per (container, object class).
+"""
+class InheritanceModel:
+    def __init__(self, class_guids: dict[str, str] | None = None):
+        """
+        :param class_guids: schemaIDGUID of each object class by lDAPDisplayName, used for inherited object types
+        """
+        self.class_guids = {name.lower(): guid.lower() for name, guid in (class_guids or {}).items()}
+
+        # explicit aces by dn
+        self.explicit: dict[str, tuple[ACE, ...]] = {}
+        # object class by dn
+        self.classes: dict[str, str | None] = {}
+        # dns of objects with protected dacls
+        self.protected: set[str] = set()
+        # owner and group by dn, replacing CREATOR OWNER and CREATOR GROUP in inherited aces
+        self.owners: dict[str, tuple[str | None, str | None]] = {}
+        # hash of the stored inherited aces by dn, used to detect mismatches without storing the aces
+        self._stored: dict[str, int] = {}
+
+        self._cache: dict[tuple[str, str | None], tuple[ACE, ...]] = {}
+
+    @classmethod
+    def from_refs(cls, refs: Iterable, class_guids: dict[str, str] | None = None) -> "InheritanceModel":
+        """
+        Create the inheritance model for all objects with a security descriptor.
+        The security descriptors are only read, the model keeps its own copy of the explicit aces.
+
+        :param refs: the objects, e.g. ActiveDirectory.map.values()
+        :param class_guids: schemaIDGUID of each object class by lDAPDisplayName
+        """
+        model = cls(class_guids)
+        for ref in refs:
+            if not ref.security_descriptor or not ref.security_descriptor.dacl:
+                continue
+            model.add(ref.dn, ref.object_class_name, ref.security_descriptor)
+        log.debug(f"Created inheritance model for {len(model.explicit)} objects")
+        return model
+
+    def add(self, dn: str, object_class: str | None, sd: NTSecurityDescriptor):
+        """
+        Add an object to the model, only its explicit aces are kept
+
+        :param dn: distinguished name of the object
+        :param object_class: most specific object class of the object
+        :param sd: security descriptor of the object
+        """
+        self.explicit[dn] = tuple(ace for ace in sd.dacl if not ace.inherited)
+        self.classes[dn] = object_class
+        self.owners[dn] = (sd.owner_sid, sd.group_sid)
+        if sd.header.control & SD_DACL_PROTECTED:
+            self.protected.add(dn)
+        self._stored[dn] = hash(frozenset(ace.key for ace in sd.dacl if ace.inherited))
+        self._cache.clear()
+
+    def inherited(self, dn: str) -> tuple[ACE, ...]:
+        """
+        The aces an object inherits from its parent, with CREATOR OWNER and CREATOR GROUP
+        replaced by the owner and group of the object in the aces that apply to the object
+
+        :param dn: distinguished name of the object
+        """
+        parent = parent_dn(dn)
+        if dn in self.protected or parent not in self.explicit:
+            return ()
+        aces = self.inheritable(parent, self.classes.get(dn))
+        owner, group = self.owners.get(dn, (None, None))
+        creators = {CREATOR_OWNER: owner, CREATOR_GROUP: group}
+        return tuple(
+            ace.copy(trustee_sid=creators[ace.trustee_sid])
+            if ace.trustee_sid in creators and creators[ace.trustee_sid] and not ace.header.flags & INHERIT_ONLY_ACE
+            else ace
+            for ace in aces
+        )
+
+    def inheritable(self, container: str, object_class: str | None) -> tuple[ACE, ...]:
+        """
+        The aces an object of the given class inherits when placed in the given container,
+        CREATOR OWNER and CREATOR GROUP are not yet replaced, see inherited
+
+        :param container: distinguished name of the container
+        :param object_class: object class of the child
+        """
+        key = (container, object_class)
+        if key not in self._cache:
+            child_guid = self.class_guids.get(object_class.lower()) if object_class else None
+            aces = []
+            for ace in self.aces(container, effective=False):
+                aces.extend(inherit_ace(ace, child_guid))
+            self._cache[key] = tuple(aces)
+        return self._cache[key]
+
+    def aces(self, dn: str, effective: bool = True) -> tuple[ACE, ...]:
+        """
+        All aces of an object, explicit and inherited
+
+        :param dn: distinguished name of the object
+        :param effective: leave out inherit only aces, which do not apply to the object itself
+        """
+        aces = self.explicit.get(dn, ()) + self.inherited(dn)
+        if effective:
+            return tuple(ace for ace in aces if not ace.header.flags & INHERIT_ONLY_ACE)
+        return aces
+
+    def mismatches(self) -> Iterator[str]:
+        """
+        Objects whose stored inherited aces differ from the computed ones,
+        e.g. because they were modified or inheritance was not propagated.
+        Objects whose parent is not part of the model are skipped.
+
+        :return: generator of distinguished names
+        """
+        for dn, stored in self._stored.items():
+            if parent_dn(dn) not in self.explicit and dn not in self.protected:
+                continue
+            if stored != hash(frozenset(ace.key for ace in self.inherited(dn))):
+                log.warning(f"Inherited ACEs of {dn} differ from the ACEs of its parent")
+                yield dn
@@ -12,15 +12,19 @@ Self-relative NTSecurityDescriptor as defined in
 https://msdn.microsoft.com/en-us/library/cc230366.aspx
 """
 class NTSecurityDescriptor:
-    def __init__(self, sd: bytes, dacl: DACL | None, header: ProtocolHeader):
+    def __init__(self, sd: bytes, dacl: DACL | None, header: ProtocolHeader, owner_sid: str | None = None, group_sid: str | None = None):
         """
         :param sd: raw binary data
         :param dacl: the dacl of the security descriptor or None if not present
         :param header: the header of the security descriptor
+        :param owner_sid: the sid of the owner or None if not present
+        :param group_sid: the sid of the primary group or None if not present
         """
         self.sd = sd
         self.dacl = dacl
         self.header = header
+        self.owner_sid = owner_sid
+        self.group_sid = group_sid
 
     @classmethod
     def from_bytes(cls, data: bytes, offset: int = 0) -> "SecurityDescriptor":
@@ -38,6 +42,13 @@ class NTSecurityDescriptor:
             log.critical("Security descriptor is not self-relative")
             exit(-1)
 
+        owner_sid, group_sid = None, None
+        # owner and group are only present if they were requested (see LDAPConnection.get_ad_security_descriptor)
+        if owner:
+            owner_sid = ProtocolHeader.parse_sid(data, owner)
+        if group:
+            group_sid = ProtocolHeader.parse_sid(data, group)
+
         dacl = None
         # check that dacl is present
         if control & 0x0004:
@@ -49,7 +60,7 @@ class NTSecurityDescriptor:
         else:
             log.warning("DACL not present in security descriptor")
 
-        return cls(data, dacl, header)
+        return cls(data, dacl, header, owner_sid, group_sid)
 
     def __getitem__(self, key):
         return self.sd[key]
@@ -35,11 +35,18 @@ ACE_FLAG_DESCRIPTIONS = {
     0x08: ("InheritOnly", "The ACE is inherited by child objects but not by the object itself"),
     0x0E: ("InheritanceFlags", "Logical `OR` of ObjectInherit, ContainerInherit, NoPropagateInherit and InheritOnly"),
     0x0F: ("Inherited", "The ACE is inherited"),
+    0x10: ("INHERITED_ACE", "The ACE was inherited from a parent object"),
 
     0x40: ("SuccessfulAccess", "Successful access attempts are audited"),
     0x80: ("FailedAccess", "Failed access attempts are audited."),
     0xC0: ("AuditFlags", "All Access attempts are audited"),
 }
+# ACE flags controlling inheritance, see https://learn.microsoft.com/en-us/openspecs/windows_protocols/ms-dtyp/628ebb1d-c509-4ea0-a10f-77ef97ca4586
+OBJECT_INHERIT_ACE = 0x01
+CONTAINER_INHERIT_ACE = 0x02
+NO_PROPAGATE_INHERIT_ACE = 0x04
+INHERIT_ONLY_ACE = 0x08
+INHERITED_ACE = 0x10
 
 # ACE masks, see https://learn.microsoft.com/en-us/openspecs/windows_protocols/ms-adts/990fb975-ab31-4bc1-8b75-5da132cd4584
 # in the form of {mask: (name, description, exploitable)}
@@ -66,6 +73,15 @@ ACE_MASK_DESCRIPTIONS = {
 
     0x00100000: ("SYNCHRONIZE", "Synchronize access"),
 }
+# mapping of the generic rights to the rights of directory objects, see
+# https://learn.microsoft.com/en-us/openspecs/windows_protocols/ms-adts/990fb975-ab31-4bc1-8b75-5da132cd4584
+DS_GENERIC_MAPPING = {
+    0x80000000: 0x00020094, # GENERIC_READ: READ_CONTROL, DS_LIST_CONTENTS, DS_READ_PROPERTY, DS_LIST_OBJECT
+    0x40000000: 0x00020028, # GENERIC_WRITE: READ_CONTROL, DS_WRITE_PROPERTY, DS_WRITE_PROPERTY_EXTENDED
+    0x20000000: 0x00020004, # GENERIC_EXECUTE: READ_CONTROL, DS_LIST_CONTENTS
+    0x10000000: 0x000F01FF, # GENERIC_ALL: all standard and directory rights
+}
+
 TRACKED_ACE_MASKS = {
     0x00000008,
     0x00000010,
@@ -17,6 +17,16 @@ class ADRef:
         # security descriptor
         self.security_descriptor = None
 
+    @property
+    def object_class_name(self) -> str | None:
+        """
+        The most specific object class of the object, e.g. `user` for (top, person, organizationalPerson, user)
+        """
+        if not hasattr(self.entry, "objectClass"):
+            return None
+        object_class = self.entry.objectClass.values
+        return object_class[-1] if object_class else None
+
     def __getattr__(self, item):
         """
         Will first try to get the attribute from the entry, if it fails it will try to convert the snake case attribute to camel case
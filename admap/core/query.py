@@ -0,0 +1,413 @@
+from plutils.log import Logger
+from admap.core.objects import ADRef
+from admap.core.nt_security.dacl import ACE
+from admap.core.nt_security.inheritance import map_generic
+from admap.core.nt_security.types import ACE_MASK_DESCRIPTIONS, ACE_TYPE_DESCRIPTIONS, ACE_ALLOW_TYPE_DESCRIPTIONS, ACE_DENY_TYPE_DESCRIPTIONS, INHERITED_ACE
+from typing import Iterable, Iterator
+from bisect import bisect_left
+import re
+
+log = Logger(__name__, color="green")
+
+"""
+Small query language over objects and their ACEs, e.g.
+
+    mask has GENERIC_WRITE and class = computer and dn under "OU=Servers,DC=corp,DC=local"
+    (mask has DS_CONTROL_ACCESS or mask has GENERIC_ALL) and dn = "DC=corp,DC=local" and not trustee = S-1-5-32-544
+
+Predicates are `<field> <op> <value>` and can be combined using `and`, `or`, `not` and parentheses:
+    - trustee = <sid>               sid of the trustee
+    - sid = <sid>                   sid of the object
+    - mask has <name|int>           all bits of the access right(s) are granted, names as in ACE_MASK_DESCRIPTIONS
+                                    generic rights are compared as the rights they map to (DS_GENERIC_MAPPING), as AD
+                                    stores them mapped, e.g. GENERIC_WRITE matches aces with 0x00020028 or GENERIC_ALL
+    - type = <name|allow|deny>      ace type, names as in ACE_TYPE_DESCRIPTIONS
+    - object_type = <guid>          object type of the ace
+    - inherited = <true|false>      whether the ace is inherited
+    - dn = <dn>, dn under <dn>      dn of the object, `under` includes the dn itself
+    - class = <name>                most specific object class of the object
+Every `=` can be negated as `!=`. Values containing whitespace, parentheses, `=`, `!` or `"` have to be quoted.
+"""
+
+_TOKEN = re.compile(r'\s*(?:(?P<paren>[()])|(?P<quoted>"(?:[^"\\]|\\.)*")|(?P<op>!=|=)|(?P<word>[^\s()="!]+))')
+
+FIELDS = {"trustee", "sid", "mask", "type", "object_type", "inherited", "dn", "class"}
+
+
+def _dn_key(dn: str) -> str:
+    """
+    Reverses the rdns of a dn, so that all objects under a container share the key of the container as prefix
+    """
+    return ",".join(reversed(re.split(r"(?<!\\),", dn.lower())))
+
+
+"""
+Indexes over the ACEs of a set of objects, used to answer queries without scanning all ACEs
+"""
+class ACEIndex:
+    def __init__(self, refs: Iterable[ADRef]):
+        """
+        :param refs: the objects to index, e.g. ActiveDirectory.map.values()
+        """
+        # one row per ace, rows of an object are consecutive
+        self.refs: list[ADRef] = []
+        self.aces: list[ACE] = []
+        self.objects: list[int] = []
+        # access masks with the generic rights mapped
+        self.masks: list[int] = []
+
+        # per object
+        self.dns: list[str] = []
+        self.classes: list[str | None] = []
+        self.sids: list[str] = []
+        # reversed dns, see _dn_key
+        self.dn_keys: list[str] = []
+        self._object_rows: list[range] = []
+
+        # indexes by value, containing row ids
+        self.by_trustee: dict[str, list[int]] = {}
+        self.by_object_type: dict[str, list[int]] = {}
+        self.by_mask_bit: dict[int, list[int]] = {1 << bit: [] for bit in range(32)}
+        self.by_class: dict[str | None, list[int]] = {}
+        self.by_sid: dict[str, list[int]] = {}
+        # objects sorted by reversed dn, for prefix lookups
+        self._sorted_dn_keys: list[tuple[str, int]] = []
+
+        for ref in refs:
+            sd = ref.security_descriptor
+            if not sd or not sd.dacl:
+                continue
+            object_id = len(self.dns)
+            self.dns.append(ref.dn)
+            self.classes.append(ref.object_class_name)
+            self.sids.append(ref.sid)
+            self.dn_keys.append(_dn_key(ref.dn))
+            start = len(self.aces)
+            for ace in sd.dacl:
+                row = len(self.aces)
+                self.refs.append(ref)
+                self.aces.append(ace)
+                self.objects.append(object_id)
+                mask = map_generic(ace.header.mask)
+                self.masks.append(mask)
+                self.by_trustee.setdefault(ace.trustee_sid, []).append(row)
+                if ace.object_type:
+                    self.by_object_type.setdefault(ace.object_type.lower(), []).append(row)
+                for bit, rows in self.by_mask_bit.items():
+                    if mask & bit:
+                        rows.append(row)
+            rows = range(start, len(self.aces))
+            self._object_rows.append(rows)
+            self.by_class.setdefault((ref.object_class_name or "").lower(), []).extend(rows)
+            self.by_sid.setdefault(ref.sid, []).extend(rows)
+            self._sorted_dn_keys.append((self.dn_keys[object_id], object_id))
+        self._sorted_dn_keys.sort()
+        log.debug(f"Indexed {len(self.aces)} ACEs of {len(self.dns)} objects")
+
+    def __len__(self) -> int:
+        return len(self.aces)
+
+    def rows_under(self, dn: str, include_children: bool = True) -> list[int]:
+        """
+        Rows of the object with the given dn and all objects under it
+
+        :param dn: the dn of the object
+        :param include_children: whether to include the objects under the given dn
+        """
+        prefix = _dn_key(dn)
+        rows = []
+        # the object itself
+        for key, object_id in self._sorted_dn_keys[bisect_left(self._sorted_dn_keys, (prefix,)):]:
+            if key != prefix:
+                break
+            rows.extend(self._object_rows[object_id])
+        if include_children:
+            # children are the keys in [prefix + ",", prefix + "-"), siblings such as
+            # "ou=servers (old)" sort between the object and its children
+            start = bisect_left(self._sorted_dn_keys, (prefix + ",",))
+            end = bisect_left(self._sorted_dn_keys, (prefix + "-",))
+            for key, object_id in self._sorted_dn_keys[start:end]:
+                rows.extend(self._object_rows[object_id])
+        return rows
+
+    def query(self, query: str) -> Iterator[tuple[ADRef, ACE]]:
+        """
+        Compile and run a query, see the module documentation for the syntax
+
+        :param query: the query
+        :return: generator of matching objects and aces
+        """
+        return compile_query(query).execute(self)
+
+
+"""
+Nodes of a compiled query. Each node can test a single row and, if possible,
+returns the candidate rows from the indexes, None means a scan is required.
+"""
+class Predicate:
+    def __init__(self, field: str, op: str, value: str):
+        self.field = field
+        self.op = op
+        self.negated = op == "!="
+        self.value = self.__parse_value(field, op, value)
+        if field == "dn":
+            # reversed dn of the value and the prefix of the keys of its children, compared against ACEIndex.dn_keys
+            self.dn_key = _dn_key(self.value)
+            self.children_prefix = self.dn_key + ","
+
+    @staticmethod
+    def __parse_value(field: str, op: str, value: str):
+        if field == "mask":
+            if op != "has":
+                raise ValueError(f"Field mask only supports `has`, not `{op}`")
+            names = {description[0]: mask for mask, description in ACE_MASK_DESCRIPTIONS.items()}
+            mask = 0
+            for part in value.split("|"):
+                if part.upper() in names:
+                    mask |= names[part.upper()]
+                else:
+                    try:
+                        mask |= int(part, 0)
+                    except ValueError:
+                        raise ValueError(f"Unknown access right {part}")
+            return map_generic(mask)
+        if op == "under" and field != "dn":
+            raise ValueError(f"`under` is only supported for dn, not {field}")
+        if op == "has":
+            raise ValueError(f"`has` is only supported for mask, not {field}")
+        match field:
+            case "type":
+                if value.lower() == "allow":
+                    return set(ACE_ALLOW_TYPE_DESCRIPTIONS)
+                if value.lower() == "deny":
+                    return set(ACE_DENY_TYPE_DESCRIPTIONS)
+                types = {description[0]: ace_type for ace_type, description in ACE_TYPE_DESCRIPTIONS.items()}
+                if value.upper() not in types:
+                    raise ValueError(f"Unknown ACE type {value}")
+                return {types[value.upper()]}
+            case "inherited":
+                if value.lower() not in ("true", "false"):
+                    raise ValueError(f"inherited has to be true or false, not {value}")
+                return value.lower() == "true"
+            case "trustee" | "sid":
+                return value.upper()
+            case "object_type":
+                value = value.lower()
+                return value if value.startswith("{") else f"{{{value}}}"
+            case "dn" | "class":
+                return value.lower()
+
+    def candidates(self, index: ACEIndex) -> list[int] | set[int] | None:
+        if self.negated:
+            return None
+        match self.field:
+            case "trustee":
+                return index.by_trustee.get(self.value, [])
+            case "sid":
+                return index.by_sid.get(self.value, [])
+            case "object_type":
+                return index.by_object_type.get(self.value, [])
+            case "class":
+                return index.by_class.get(self.value, [])
+            case "dn":
+                return index.rows_under(self.value, include_children=self.op == "under")
+            case "mask":
+                bits = [index.by_mask_bit[1 << bit] for bit in range(32) if self.value & (1 << bit)]
+                if not bits:
+                    return None
+                # intersect starting with the rarest bit
+                bits.sort(key=len)
+                rows = set(bits[0])
+                for other in bits[1:]:
+                    rows.intersection_update(other)
+                return rows
+        return None
+
+    def match(self, index: ACEIndex, row: int) -> bool:
+        ace = index.aces[row]
+        match self.field:
+            case "trustee":
+                result = ace.trustee_sid == self.value
+            case "sid":
+                result = index.sids[index.objects[row]] == self.value
+            case "mask":
+                result = index.masks[row] & self.value == self.value
+            case "type":
+                result = ace.header.type in self.value
+            case "object_type":
+                result = (ace.object_type or "").lower() == self.value
+            case "inherited":
+                result = bool(ace.header.flags & INHERITED_ACE) == self.value
+            case "dn":
+                key = index.dn_keys[index.objects[row]]
+                result = key == self.dn_key or (self.op == "under" and key.startswith(self.children_prefix))
+            case "class":
+                result = (index.classes[index.objects[row]] or "").lower() == self.value
+        return result != self.negated
+
+    def __str__(self) -> str:
+        return f"{self.field} {self.op} {self.value}"
+
+
+class And:
+    def __init__(self, *nodes):
+        self.nodes = nodes
+
+    def candidates(self, index: ACEIndex) -> set[int] | None:
+        indexed = [candidates for candidates in (node.candidates(index) for node in self.nodes) if candidates is not None]
+        if not indexed:
+            return None
+        indexed.sort(key=len)
+        rows = set(indexed[0])
+        for other in indexed[1:]:
+            rows.intersection_update(other)
+        return rows
+
+    def match(self, index: ACEIndex, row: int) -> bool:
+        return all(node.match(index, row) for node in self.nodes)
+
+    def __str__(self) -> str:
+        return "(" + " and ".join(str(node) for node in self.nodes) + ")"
+
+
+class Or:
+    def __init__(self, *nodes):
+        self.nodes = nodes
+
+    def candidates(self, index: ACEIndex) -> set[int] | None:
+        rows = set()
+        for node in self.nodes:
+            candidates = node.candidates(index)
+            # a single branch requiring a scan requires scanning everything
+            if candidates is None:
+                return None
+            rows.update(candidates)
+        return rows
+
+    def match(self, index: ACEIndex, row: int) -> bool:
+        return any(node.match(index, row) for node in self.nodes)
+
+    def __str__(self) -> str:
+        return "(" + " or ".join(str(node) for node in self.nodes) + ")"
+
+
+class Not:
+    def __init__(self, node):
+        self.node = node
+
+    def candidates(self, index: ACEIndex) -> None:
+        return None
+
+    def match(self, index: ACEIndex, row: int) -> bool:
+        return not self.node.match(index, row)
+
+    def __str__(self) -> str:
+        return f"not {self.node}"
+
+
+"""
+A compiled query, the candidate rows are taken from the indexes where possible
+and only the candidates are tested against the whole query
+"""
+class Query:
+    def __init__(self, text: str, root):
+        self.text = text
+        self.root = root
+
+    def execute(self, index: ACEIndex) -> Iterator[tuple[ADRef, ACE]]:
+        """
+        Run the query against the index
+
+        :return: generator of matching objects and aces
+        """
+        candidates = self.root.candidates(index)
+        if candidates is None:
+            log.debug(f"Query {self} requires a scan of {len(index)} ACEs")
+            rows = range(len(index))
+        else:
+            log.debug(f"Query {self} has {len(candidates)} candidates")
+            rows = sorted(candidates)
+        for row in rows:
+            if self.root.match(index, row):
+                yield index.refs[row], index.aces[row]
+
+    def __str__(self) -> str:
+        return str(self.root)
+
+
+def _tokenize(text: str) -> list[str]:
+    tokens = []
+    position = 0
+    text = text.rstrip()
+    while position < len(text):
+        token = _TOKEN.match(text, position)
+        if not token:
+            raise ValueError(f"Invalid query at position {position}: {text[position:]}")
+        position = token.end()
+        if token.group("quoted"):
+            # keep the quotes to distinguish values from keywords
+            tokens.append(token.group("quoted"))
+        else:
+            tokens.append(token.group(token.lastgroup))
+    return tokens
+
+
+def compile_query(text: str) -> Query:
+    """
+    Compile a query, see the module documentation for the syntax.
+    Raises a ValueError if the query is invalid.
+
+    :param text: the query
+    :return: the compiled query
+    """
+    tokens = _tokenize(text)
+    position = 0
+
+    def peek() -> str | None:
+        return tokens[position] if position < len(tokens) else None
+
+    def take() -> str:
+        nonlocal position
+        if position >= len(tokens):
+            raise ValueError(f"Unexpected end of query: {text}")
+        position += 1
+        return tokens[position - 1]
+
+    def expression():
+        nodes = [term()]
+        while (peek() or "").lower() == "or":
+            take()
+            nodes.append(term())
+        return nodes[0] if len(nodes) == 1 else Or(*nodes)
+
+    def term():
+        nodes = [factor()]
+        while (peek() or "").lower() == "and":
+            take()
+            nodes.append(factor())
+        return nodes[0] if len(nodes) == 1 else And(*nodes)
+
+    def factor():
+        token = take()
+        if token.lower() == "not":
+            return Not(factor())
+        if token == "(":
+            node = expression()
+            if take() != ")":
+                raise ValueError(f"Missing closing parenthesis in query: {text}")
+            return node
+        field = token.lower()
+        if field not in FIELDS:
+            raise ValueError(f"Unknown field {token}, expected one of {', '.join(sorted(FIELDS))}")
+        op = take().lower()
+        if op not in ("=", "!=", "has", "under"):
+            raise ValueError(f"Unknown operator {op} for field {field}")
+        value = take()
+        if value.startswith('"'):
+            value = value[1:-1].replace('\\"', '"')
+        return Predicate(field, op, value)
+
+    root = expression()
+    if peek() is not None:
+        raise ValueError(f"Unexpected {peek()} in query: {text}")
+    return Query(text, root)
@@ -0,0 +1,173 @@
+from plutils.log import Logger
+import threading
+import random
+
+log = Logger(__name__, "green")
+
+
+# LDAP result codes that indicate that the server is overloaded, see
+# https://learn.microsoft.com/en-us/openspecs/windows_protocols/ms-adts/d8d04a8b-9fd5-4b5d-b6c7-a6ea4bfd50dc
+LDAP_OVERLOAD_RESULTS = {
+    3: "timeLimitExceeded",
+    11: "adminLimitExceeded",
+    51: "busy",
+    52: "unavailable",
+}
+
+
+"""
+Adaptive scheduler for the requests sent to a single LDAP server.
+Limits the number of in-flight requests and the page size of searches using
+additive increase / multiplicative decrease on the observed latency and errors,
+so that a crawl runs close to the capacity of the server without overloading it.
+"""
+class RequestScheduler:
+    # schedulers shared by all connections to the same server
+    _servers: dict[str, "RequestScheduler"] = {}
+    _servers_lock = threading.Lock()
+
+    def __init__(self, server: str, max_in_flight: int = 16, page_size: int = 1000, min_page_size: int = 50,
+                 max_retries: int = 5, backoff: float = 0.5, max_backoff: float = 30.0, latency_tolerance: float = 2.0):
+        """
+        :param server: the server the requests are sent to
+        :param max_in_flight: upper bound for concurrent requests
+        :param page_size: initial (and maximum) page size of searches
+        :param min_page_size: lower bound for the page size of searches
+        :param max_retries: how often a failed request is retried
+        :param backoff: base delay in seconds before retrying a request
+        :param max_backoff: maximum delay in seconds before retrying a request
+        :param latency_tolerance: how much slower than the fastest observed request a request may be before backing off
+        """
+        self.server = server
+        self.max_in_flight = max_in_flight
+        self.max_page_size = page_size
+        self.min_page_size = min_page_size
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.latency_tolerance = latency_tolerance
+
+        # current limits, start conservative and grow while the server keeps up
+        self.limit: float = min(2, max_in_flight)
+        self._page_size: float = page_size
+
+        # statistics, latency is tracked per kind of request as e.g. paged searches
+        # take a lot longer than reading a single security descriptor
+        self.latency: dict[str, float] = {}
+        self.min_latency: dict[str, float] = {}
+        self.requests = 0
+        self.errors = 0
+
+        self._in_flight = 0
+        self._cond = threading.Condition()
+
+    @classmethod
+    def for_server(cls, server: str, **kwargs) -> "RequestScheduler":
+        """
+        Get the scheduler for the given server, creating it if necessary
+        """
+        with cls._servers_lock:
+            if server not in cls._servers:
+                cls._servers[server] = cls(server, **kwargs)
+                return cls._servers[server]
+            scheduler = cls._servers[server]
+        # limits are shared by all connections to the server, thus the settings of the first connection are kept
+        ignored = {key: value for key, value in kwargs.items() if scheduler.settings.get(key) != value}
+        if ignored:
+            kept = {key: scheduler.settings[key] for key in ignored if key in scheduler.settings}
+            log.warning(f"Scheduler for {server} already exists, ignoring {ignored} and keeping {kept}")
+        return scheduler
+
+    @property
+    def settings(self) -> dict:
+        """
+        The settings the scheduler was created with, see __init__
+        """
+        return {
+            "max_in_flight": self.max_in_flight,
+            "page_size": self.max_page_size,
+            "min_page_size": self.min_page_size,
+            "max_retries": self.max_retries,
+            "backoff": self.backoff,
+            "max_backoff": self.max_backoff,
+            "latency_tolerance": self.latency_tolerance,
+        }
+
+    @property
+    def page_size(self) -> int:
+        """
+        The page size to use for the next search request
+        """
+        return int(self._page_size)
+
+    @property
+    def in_flight(self) -> int:
+        return self._in_flight
+
+    def acquire(self):
+        """
+        Wait until another request may be sent to the server
+        """
+        with self._cond:
+            while self._in_flight >= int(self.limit):
+                self._cond.wait()
+            self._in_flight += 1
+
+    def release(self):
+        with self._cond:
+            self._in_flight -= 1
+            self._cond.notify()
+
+    def __enter__(self) -> "RequestScheduler":
+        self.acquire()
+        return self
+
+    def __exit__(self, *args):
+        self.release()
+
+    def record_success(self, latency: float, kind: str = "search"):
+        """
+        Record a successful request and adjust the limits to the observed latency
+
+        :param latency: duration of the request in seconds
+        :param kind: the kind of request, latencies are only compared between requests of the same kind
+        """
+        with self._cond:
+            self.requests += 1
+            self.latency[kind] = 0.8 * self.latency.get(kind, latency) + 0.2 * latency
+            self.min_latency[kind] = min(self.min_latency.get(kind, latency), latency)
+
+            if self.latency[kind] <= self.min_latency[kind] * self.latency_tolerance:
+                # server keeps up, grow by about one request per round trip
+                self.limit = min(self.max_in_flight, self.limit + 1 / self.limit)
+                self._page_size = min(self.max_page_size, self._page_size * 1.1)
+            else:
+                # latency is rising, the server is queueing requests
+                self.limit = max(1, self.limit * 0.9)
+            self._cond.notify_all()
+
+    def record_overload(self, reason: str):
+        """
+        Record a request that failed because the server is overloaded or unavailable
+        and halve the limits
+
+        :param reason: description of the error
+        """
+        with self._cond:
+            self.requests += 1
+            self.errors += 1
+            self.limit = max(1, self.limit / 2)
+            self._page_size = max(self.min_page_size, self._page_size / 2)
+            log.warning(f"{self.server} is overloaded ({reason}), limiting to {int(self.limit)} requests with page size {self.page_size}")
+
+    def delay(self, attempt: int) -> float:
+        """
+        Exponential backoff with full jitter
+
+        :param attempt: the number of the failed attempt, starting at 0
+        :return: how long to wait in seconds before retrying
+        """
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+
+    def __str__(self) -> str:
+        return f"{self.server}: {self._in_flight}/{int(self.limit)} in flight, page size {self.page_size}, latency {self.latency}, {self.errors}/{self.requests} errors"
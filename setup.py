@@ -18,6 +18,7 @@ setup(
         "rich",
         "impacket",
         "textualize",
+        "pyarrow",
     ],
     description="Mapper for active directory",
     long_description=long_description,
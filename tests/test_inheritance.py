@@ -0,0 +1,133 @@
+from admap.core.nt_security.dacl import ACE
+from admap.core.nt_security.header import ProtocolHeader
+from admap.core.nt_security.inheritance import InheritanceModel, inherit_ace, parent_dn
+from types import SimpleNamespace
+import struct
+import uuid
+import pytest
+
+COMPUTER = "{bf967a86-0de6-11d0-a285-00aa003049e2}"
+USER = "{bf967aba-0de6-11d0-a285-00aa003049e2}"
+ORGANIZATIONAL_UNIT = "{bf967aa5-0de6-11d0-a285-00aa003049e2}"
+CLASS_GUIDS = {"computer": COMPUTER, "user": USER, "organizationalUnit": ORGANIZATIONAL_UNIT}
+
+AUTHENTICATED_USERS = "S-1-5-11"
+CREATOR_OWNER = "S-1-3-0"
+OWNER = "S-1-5-21-1-2-3-1105"
+
+
+def make_ace(ace_type: int, flags: int, mask: int, trustee_sid: str, object_type: str | None = None, inherited_object_type: str | None = None) -> ACE:
+    body = b""
+    if ace_type in (0x05, 0x06):
+        body += struct.pack("<I", (1 if object_type else 0) | (2 if inherited_object_type else 0))
+        for guid in (object_type, inherited_object_type):
+            if guid:
+                body += uuid.UUID(guid).bytes_le
+    body += ProtocolHeader.pack_sid(trustee_sid)
+    return ACE.from_bytes_single(struct.pack("<BBHI", ace_type, flags, 8 + len(body), mask) + body)
+
+
+def make_sd(aces: list[ACE], owner_sid: str = OWNER, control: int = 0x8404):
+    return SimpleNamespace(dacl=aces, owner_sid=owner_sid, group_sid="S-1-5-21-1-2-3-513", header=SimpleNamespace(control=control))
+
+
+def summary(aces: list[ACE]) -> list[tuple]:
+    return [(ace.header.flags, ace.header.mask, ace.trustee_sid) for ace in aces]
+
+
+@pytest.mark.parametrize("flags, expected", [
+    # container inherit, propagated further
+    (0x02, [0x12]),
+    # inherit only on the parent does not apply to the child
+    (0x0a, [0x12]),
+    # object inherit only, passed on to the objects within the child
+    (0x01, [0x19]),
+    # applies to the child but is not propagated
+    (0x06, [0x10]),
+    (0x05, []),
+    # not inheritable
+    (0x00, []),
+])
+def test_inherit_flags(flags: int, expected: list[int]):
+    ace = make_ace(0x00, flags, 0x00000020, AUTHENTICATED_USERS)
+    assert [flags for flags, mask, sid in summary(inherit_ace(ace, COMPUTER))] == expected
+
+
+def test_inherit_by_non_container():
+    assert summary(inherit_ace(make_ace(0x00, 0x01, 0x20, AUTHENTICATED_USERS), None, is_container=False)) == [(0x10, 0x20, AUTHENTICATED_USERS)]
+    assert inherit_ace(make_ace(0x00, 0x02, 0x20, AUTHENTICATED_USERS), None, is_container=False) == []
+
+
+def test_inherited_object_type():
+    ace = make_ace(0x05, 0x02, 0x20, AUTHENTICATED_USERS, inherited_object_type=COMPUTER)
+    assert summary(inherit_ace(ace, COMPUTER)) == [(0x12, 0x20, AUTHENTICATED_USERS)]
+    # other classes only pass it on
+    assert summary(inherit_ace(ace, USER)) == [(0x1a, 0x20, AUTHENTICATED_USERS)]
+
+    not_propagated = make_ace(0x05, 0x06, 0x20, AUTHENTICATED_USERS, inherited_object_type=COMPUTER)
+    assert inherit_ace(not_propagated, USER) == []
+
+
+def test_generic_rights_are_split():
+    ace = make_ace(0x00, 0x02, 0x10000000, AUTHENTICATED_USERS)
+    assert summary(inherit_ace(ace, COMPUTER)) == [
+        (0x10, 0x000F01FF, AUTHENTICATED_USERS),
+        (0x1a, 0x10000000, AUTHENTICATED_USERS),
+    ]
+
+    not_propagated = make_ace(0x00, 0x06, 0x10000000, AUTHENTICATED_USERS)
+    assert summary(inherit_ace(not_propagated, COMPUTER)) == [(0x10, 0x000F01FF, AUTHENTICATED_USERS)]
+
+
+def test_creator_owner_is_split_and_replaced():
+    ace = make_ace(0x00, 0x02, 0x00020094, CREATOR_OWNER)
+    assert summary(inherit_ace(ace, COMPUTER)) == [
+        (0x10, 0x00020094, CREATOR_OWNER),
+        (0x1a, 0x00020094, CREATOR_OWNER),
+    ]
+
+    model = InheritanceModel(CLASS_GUIDS)
+    model.add("OU=Servers,DC=corp,DC=local", "organizationalUnit", make_sd([ace]))
+    model.add("CN=pc,OU=Servers,DC=corp,DC=local", "computer", make_sd([]))
+    assert summary(model.inherited("CN=pc,OU=Servers,DC=corp,DC=local")) == [
+        (0x10, 0x00020094, OWNER),
+        (0x1a, 0x00020094, CREATOR_OWNER),
+    ]
+
+
+def test_copy_round_trip():
+    ace = make_ace(0x05, 0x0a, 0x00000008, CREATOR_OWNER, object_type=COMPUTER, inherited_object_type=COMPUTER)
+    copy = ace.copy(flags=0x10, mask=0x00000020, trustee_sid=OWNER)
+    parsed = ACE.from_bytes_single(copy.data + b"\xff" * 8)
+
+    assert copy.header.size == len(copy.data)
+    assert parsed.data == copy.data
+    assert parsed.key == copy.key == (0x05, 0x10, 0x00000020, OWNER, COMPUTER, COMPUTER)
+
+
+@pytest.mark.parametrize("sid", ["S-1-3-0", "S-1-5-32-544", "S-1-5-21-3623811015-3361044348-30300820-1013"])
+def test_pack_sid_round_trip(sid: str):
+    assert ProtocolHeader.parse_sid(ProtocolHeader.pack_sid(sid)) == sid
+
+
+def test_parent_dn():
+    assert parent_dn("CN=Smith\\, John,OU=Users,DC=corp,DC=local") == "OU=Users,DC=corp,DC=local"
+    assert parent_dn("DC=local") is None
+
+
+def test_mismatches():
+    parent = [
+        make_ace(0x00, 0x02, 0x00020094, AUTHENTICATED_USERS),
+        make_ace(0x05, 0x0a, 0x00000008, CREATOR_OWNER, object_type=COMPUTER, inherited_object_type=COMPUTER),
+    ]
+    inherited = [ace for parent_ace in parent for ace in inherit_ace(parent_ace, COMPUTER)]
+    stored = [ace.copy(trustee_sid=OWNER) if ace.trustee_sid == CREATOR_OWNER and not ace.header.flags & 0x08 else ace for ace in inherited]
+
+    model = InheritanceModel(CLASS_GUIDS)
+    model.add("OU=Servers,DC=corp,DC=local", "organizationalUnit", make_sd(parent))
+    model.add("CN=pc,OU=Servers,DC=corp,DC=local", "computer", make_sd(stored))
+    model.add("CN=tampered,OU=Servers,DC=corp,DC=local", "computer", make_sd(stored[1:]))
+    model.add("CN=protected,OU=Servers,DC=corp,DC=local", "computer", make_sd([], control=0x9404))
+
+    assert model.inherited("CN=protected,OU=Servers,DC=corp,DC=local") == ()
+    assert list(model.mismatches()) == ["CN=tampered,OU=Servers,DC=corp,DC=local"]
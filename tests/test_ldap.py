@@ -0,0 +1,122 @@
+from admap.core.ldap import LDAPConnection, PAGED_RESULTS_OID
+from admap.core.scheduler import RequestScheduler
+from ldap3.core.exceptions import LDAPBindError, LDAPOperationResult, LDAPSocketReceiveError
+import itertools
+import threading
+import pytest
+
+
+class FakeConnection:
+    """
+    Paged search over the entries 0..total-1, cookies are only valid on the connection that issued them.
+    The script contains the outcome of the next searches on any connection: None (answer normally),
+    "lost" (connection is lost), or an ldap result code.
+    """
+    ids = itertools.count()
+
+    def __init__(self, script: list, total: int, bound: bool = True, bind_result: bool = True):
+        self.id = next(self.ids)
+        self.script = script
+        self.total = total
+        self.bound = bound
+        self.bind_result = bind_result
+        self.cookies = {}
+        self.result = {}
+        self.entries = []
+        self.searches = 0
+
+    def bind(self):
+        self.bound = self.bind_result
+        if not self.bind_result:
+            self.result = {"result": 49, "description": "invalidCredentials"}
+        return self.bind_result
+
+    def unbind(self):
+        self.bound = False
+
+    def search(self, paged_size=None, paged_cookie=None, **kwargs):
+        self.searches += 1
+        outcome = self.script.pop(0) if self.script else None
+        if outcome == "lost":
+            raise LDAPSocketReceiveError("connection lost")
+        if outcome is not None:
+            self.result = {"result": outcome, "description": "scripted"}
+            return False
+        if paged_cookie is not None and paged_cookie not in self.cookies:
+            # unwillingToPerform, cookie of another connection
+            self.result = {"result": 53, "description": "unwillingToPerform"}
+            return False
+
+        position = self.cookies.get(paged_cookie, 0)
+        size = paged_size or self.total
+        self.entries = list(range(position, min(self.total, position + size)))
+        position += size
+        cookie = None
+        if position < self.total:
+            cookie = f"{self.id}-{position}".encode()
+            self.cookies[cookie] = position
+        self.result = {"result": 0, "controls": {PAGED_RESULTS_OID: {"value": {"cookie": cookie}}}}
+        return True
+
+
+def make_connection(script: list, total: int = 5, max_retries: int = 5, **kwargs) -> LDAPConnection:
+    # bypasses __init__, which connects to a server
+    conn = LDAPConnection.__new__(LDAPConnection)
+    conn.scheduler = RequestScheduler("test", page_size=2, min_page_size=2, max_retries=max_retries, backoff=0)
+    conn._pool = []
+    conn._pool_lock = threading.Lock()
+    conn._ad_root = "DC=corp,DC=local"
+    conn.created = []
+
+    def connect():
+        fake = FakeConnection(script, total, **kwargs)
+        conn.created.append(fake)
+        return fake
+    conn._connect = connect
+    return conn
+
+
+def test_paged_search_uses_single_connection():
+    conn = make_connection([])
+    assert conn.search() == [0, 1, 2, 3, 4]
+    assert len(conn.created) == 1
+    assert conn.created[0].searches == 3
+
+
+def test_overloaded_page_is_retried_on_same_connection():
+    conn = make_connection([None, 51])
+    assert conn.search() == [0, 1, 2, 3, 4]
+    assert len(conn.created) == 1
+    assert conn.scheduler.errors == 1
+
+
+def test_lost_connection_restarts_from_first_page():
+    conn = make_connection([None, "lost"])
+    assert conn.search() == [0, 1, 2, 3, 4]
+    assert len(conn.created) == 2
+    # the first connection was discarded, not returned to the pool
+    assert conn._pool == [conn.created[1]]
+
+
+def test_error_result_raises():
+    conn = make_connection([None, 50])
+    with pytest.raises(LDAPOperationResult):
+        conn.search()
+    # errors other than overload are not retried nor recorded as overload
+    assert conn.created[0].searches == 2
+    assert conn.scheduler.errors == 0
+
+
+def test_bind_failure_is_not_retried():
+    conn = make_connection([], bound=False, bind_result=False)
+    with pytest.raises(LDAPBindError):
+        conn.search()
+    assert len(conn.created) == 1
+    assert conn.scheduler.errors == 0
+
+
+def test_retries_are_exhausted():
+    conn = make_connection([51] * 10, max_retries=2)
+    with pytest.raises(ConnectionError):
+        conn.search(paged=False)
+    assert sum(fake.searches for fake in conn.created) == 3
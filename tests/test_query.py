@@ -0,0 +1,72 @@
+from admap.core.query import ACEIndex, compile_query
+from types import SimpleNamespace
+
+
+def make_ref(dn: str, sid: str, object_class: str, mask: int = 0x00020028, trustee_sid: str = "S-1-5-21-1-1000"):
+    ace = SimpleNamespace(
+        trustee_sid=trustee_sid,
+        object_type=None,
+        inherited_object_type=None,
+        header=SimpleNamespace(type=0x00, flags=0x00, mask=mask),
+    )
+    return SimpleNamespace(dn=dn, sid=sid, object_class_name=object_class, security_descriptor=SimpleNamespace(dacl=[ace]))
+
+
+def run(index: ACEIndex, query: str) -> list[str]:
+    return sorted(ref.dn for ref, ace in compile_query(query).execute(index))
+
+
+def test_dn_under_skips_siblings_sorted_before_children():
+    index = ACEIndex([
+        make_ref("DC=corp,DC=local", "S-1-5-21-1-1", "domainDNS"),
+        make_ref("OU=Servers,DC=corp,DC=local", "S-1-5-21-1-2", "organizationalUnit"),
+        make_ref("OU=Servers (Old),DC=corp,DC=local", "S-1-5-21-1-3", "organizationalUnit"),
+        make_ref("CN=old,OU=Servers (Old),DC=corp,DC=local", "S-1-5-21-1-4", "computer"),
+        make_ref("CN=pc,OU=Servers,DC=corp,DC=local", "S-1-5-21-1-5", "computer"),
+        make_ref("OU=Servers&Co,DC=corp,DC=local", "S-1-5-21-1-6", "organizationalUnit"),
+    ])
+    expected = ["CN=pc,OU=Servers,DC=corp,DC=local", "OU=Servers,DC=corp,DC=local"]
+
+    # indexed and scanned plans return the same rows
+    assert run(index, 'dn under "OU=Servers,DC=corp,DC=local"') == expected
+    assert run(index, 'not not dn under "OU=Servers,DC=corp,DC=local"') == expected
+    assert run(index, 'dn = "OU=Servers,DC=corp,DC=local"') == ["OU=Servers,DC=corp,DC=local"]
+
+
+def test_indexed_predicates_match_scan():
+    index = ACEIndex([
+        make_ref("CN=pc,OU=Servers,DC=corp,DC=local", "S-1-5-21-1-5", "computer"),
+        make_ref("CN=user,OU=Servers,DC=corp,DC=local", "S-1-5-21-1-7", "user", mask=0x00000100),
+        make_ref("CN=pc2,OU=Other,DC=corp,DC=local", "S-1-5-21-1-8", "computer", trustee_sid="S-1-5-32-544"),
+    ])
+    query = 'mask has GENERIC_WRITE and class = computer and trustee = S-1-5-21-1-1000'
+
+    assert run(index, query) == ["CN=pc,OU=Servers,DC=corp,DC=local"]
+    assert run(index, f"not not ({query})") == ["CN=pc,OU=Servers,DC=corp,DC=local"]
+
+
+def test_generic_rights_match_mapped_masks():
+    index = ACEIndex([
+        make_ref("CN=pc,OU=Servers,DC=corp,DC=local", "S-1-5-21-1-5", "computer"),
+        make_ref("CN=all,OU=Servers,DC=corp,DC=local", "S-1-5-21-1-6", "computer", mask=0x000F01FF),
+        make_ref("CN=generic,OU=Servers,DC=corp,DC=local", "S-1-5-21-1-7", "computer", mask=0x40000000),
+        make_ref("CN=read,OU=Servers,DC=corp,DC=local", "S-1-5-21-1-8", "computer", mask=0x00020094),
+    ])
+
+    assert run(index, "mask has GENERIC_WRITE") == [
+        "CN=all,OU=Servers,DC=corp,DC=local",
+        "CN=generic,OU=Servers,DC=corp,DC=local",
+        "CN=pc,OU=Servers,DC=corp,DC=local",
+    ]
+    assert run(index, "mask has GENERIC_ALL") == ["CN=all,OU=Servers,DC=corp,DC=local"]
+    assert run(index, "not mask has GENERIC_WRITE") == ["CN=read,OU=Servers,DC=corp,DC=local"]
+
+
+def test_operators_without_spaces():
+    index = ACEIndex([
+        make_ref("CN=pc,OU=Servers,DC=corp,DC=local", "S-1-5-21-1-5", "computer"),
+        make_ref("CN=pc2,OU=Other,DC=corp,DC=local", "S-1-5-21-1-8", "computer", trustee_sid="S-1-5-32-544"),
+    ])
+
+    assert run(index, "trustee!=S-1-5-32-544") == ["CN=pc,OU=Servers,DC=corp,DC=local"]
+    assert run(index, "trustee=S-1-5-32-544") == ["CN=pc2,OU=Other,DC=corp,DC=local"]
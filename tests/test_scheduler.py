@@ -0,0 +1,86 @@
+from admap.core.scheduler import RequestScheduler
+import threading
+
+
+def test_success_grows_limits_up_to_bounds():
+    scheduler = RequestScheduler("test", max_in_flight=4, page_size=100)
+    scheduler.record_overload("busy")
+    assert scheduler.limit == 1
+    assert scheduler.page_size == 50
+
+    for _ in range(100):
+        scheduler.record_success(0.01)
+    assert scheduler.limit == 4
+    assert scheduler.page_size == 100
+
+
+def test_rising_latency_shrinks_limit():
+    scheduler = RequestScheduler("test", max_in_flight=16)
+    for _ in range(20):
+        scheduler.record_success(0.01)
+    limit = scheduler.limit
+
+    for _ in range(10):
+        scheduler.record_success(1.0)
+    assert scheduler.limit < limit
+    assert scheduler.limit >= 1
+
+
+def test_latency_is_compared_per_kind():
+    scheduler = RequestScheduler("test", max_in_flight=16)
+    for _ in range(20):
+        scheduler.record_success(0.01, "search")
+    limit = scheduler.limit
+
+    # a slower kind of request does not count as rising latency
+    scheduler.record_success(1.0, "page")
+    assert scheduler.limit > limit
+
+
+def test_overload_halves_limits_down_to_bounds():
+    scheduler = RequestScheduler("test", max_in_flight=16, page_size=1000, min_page_size=100)
+    for _ in range(300):
+        scheduler.record_success(0.01)
+    assert scheduler.limit == 16
+
+    scheduler.record_overload("busy")
+    assert scheduler.limit == 8
+    assert scheduler.page_size == 500
+
+    for _ in range(10):
+        scheduler.record_overload("busy")
+    assert scheduler.limit == 1
+    assert scheduler.page_size == 100
+    assert scheduler.errors == 11
+
+
+def test_acquire_waits_for_free_slot():
+    scheduler = RequestScheduler("test", max_in_flight=1)
+    acquired = threading.Event()
+
+    def worker():
+        with scheduler:
+            acquired.set()
+
+    scheduler.acquire()
+    thread = threading.Thread(target=worker)
+    thread.start()
+    assert not acquired.wait(0.1)
+    assert scheduler.in_flight == 1
+
+    scheduler.release()
+    assert acquired.wait(1)
+    thread.join()
+    assert scheduler.in_flight == 0
+
+
+def test_delay_is_bounded():
+    scheduler = RequestScheduler("test", backoff=1.0, max_backoff=5.0)
+    assert all(0 <= scheduler.delay(attempt) <= 5.0 for attempt in range(20))
+
+
+def test_for_server_shares_scheduler_and_keeps_settings():
+    first = RequestScheduler.for_server("test-shared:389", page_size=200)
+    second = RequestScheduler.for_server("test-shared:389", page_size=500)
+    assert first is second
+    assert second.settings["page_size"] == 200